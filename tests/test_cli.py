@@ -0,0 +1,145 @@
+import os
+import stat
+import sys
+import tempfile
+import threading
+import shutil
+from pathlib import Path
+
+import pytest
+
+from textmeld.cli import main
+
+
+@pytest.fixture
+def temp_directory():
+    """テスト用の一時ディレクトリを作成"""
+    temp_dir = tempfile.mkdtemp()
+    yield temp_dir
+    shutil.rmtree(temp_dir)
+
+
+def run_cli(monkeypatch, *args: str) -> int:
+    """引数を指定してCLIを実行"""
+    monkeypatch.setattr(sys, "argv", ["textmeld", *args])
+    return main()
+
+
+def test_output_inside_target_directory(temp_directory, monkeypatch):
+    """出力ファイルが対象ディレクトリ内にあっても、出力に自身が含まれないことを確認"""
+    proj = Path(temp_directory) / "proj"
+    proj.mkdir()
+    (proj / "main.py").write_text("print('Hello')\n")
+    output = proj / "out.txt"
+
+    assert run_cli(monkeypatch, str(proj), "-o", str(output)) == 0
+
+    result = output.read_text()
+    assert "File: main.py" in result
+    assert "out.txt" not in result
+    # 一時ファイルが残っていないことを確認
+    assert sorted(os.listdir(proj)) == ["main.py", "out.txt"]
+
+
+def test_existing_output_kept_on_error(temp_directory, monkeypatch):
+    """処理に失敗した場合、既存の出力ファイルが上書きされないことを確認"""
+    output = Path(temp_directory) / "existing.txt"
+    output.write_text("previous result\n")
+
+    missing = os.path.join(temp_directory, "nosuchdir")
+    assert run_cli(monkeypatch, missing, "-o", str(output)) == 1
+
+    assert output.read_text() == "previous result\n"
+    assert os.listdir(temp_directory) == ["existing.txt"]
+
+
+def test_max_file_size_option(temp_directory, monkeypatch):
+    """--max-file-sizeを超えるファイルの内容が省略されることを確認"""
+    proj = Path(temp_directory) / "proj"
+    proj.mkdir()
+    (proj / "small.txt").write_text("small\n")
+    (proj / "large.txt").write_text("x" * 100)
+    output = Path(temp_directory) / "out.txt"
+
+    assert run_cli(monkeypatch, str(proj), "-o", str(output), "--max-file-size", "50") == 0
+
+    result = output.read_text()
+    assert "small" in result
+    assert "File: large.txt" in result
+    assert "skipped (too large)" in result
+    assert "x" * 100 not in result
+
+
+@pytest.fixture
+def proj(temp_directory):
+    """出力先のテスト用に最小限の対象ディレクトリを作成"""
+    proj = Path(temp_directory) / "proj"
+    proj.mkdir()
+    (proj / "main.py").write_text("print('Hello')\n")
+    return proj
+
+
+def test_symlinked_output_writes_through_link(temp_directory, proj, monkeypatch):
+    """出力先がシンボリックリンクの場合、リンク先に書き込みリンクは残ることを確認"""
+    real = Path(temp_directory) / "real.txt"
+    real.write_text("old\n")
+    link = Path(temp_directory) / "link.txt"
+    link.symlink_to(real)
+
+    assert run_cli(monkeypatch, str(proj), "-o", str(link)) == 0
+
+    assert link.is_symlink()
+    assert "File: main.py" in real.read_text()
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="requires mkfifo")
+def test_fifo_output_is_streamed(temp_directory, proj, monkeypatch):
+    """出力先がFIFOの場合、置き換えずにそのまま書き込むことを確認"""
+    fifo = Path(temp_directory) / "out.fifo"
+    os.mkfifo(fifo)
+    received = []
+    reader = threading.Thread(target=lambda: received.append(fifo.read_text()))
+    reader.start()
+
+    assert run_cli(monkeypatch, str(proj), "-o", str(fifo)) == 0
+    reader.join(timeout=10)
+
+    assert fifo.is_fifo()
+    assert "File: main.py" in received[0]
+
+
+def test_existing_output_mode_is_kept(temp_directory, proj, monkeypatch):
+    """既存の出力ファイルの権限が引き継がれることを確認"""
+    output = Path(temp_directory) / "out.txt"
+    output.write_text("old\n")
+    output.chmod(0o600)
+
+    assert run_cli(monkeypatch, str(proj), "-o", str(output)) == 0
+
+    assert stat.S_IMODE(output.stat().st_mode) == 0o600
+    assert "File: main.py" in output.read_text()
+
+
+def test_hardlinked_output_is_written_in_place(temp_directory, proj, monkeypatch):
+    """出力ファイルがハードリンクされている場合、リンクを切らずに書き込むことを確認"""
+    output = Path(temp_directory) / "out.txt"
+    output.write_text("old\n")
+    other = Path(temp_directory) / "other.txt"
+    os.link(output, other)
+
+    assert run_cli(monkeypatch, str(proj), "-o", str(output)) == 0
+
+    assert "File: main.py" in other.read_text()
+
+
+def test_output_in_unwritable_directory(temp_directory, proj, monkeypatch):
+    """一時ファイルを作れないディレクトリでも、既存のファイルには直接書き込むことを確認"""
+    output = Path(temp_directory) / "out.txt"
+    output.write_text("old\n")
+
+    def deny_mkstemp(*args, **kwargs):
+        raise PermissionError("permission denied")
+
+    monkeypatch.setattr(tempfile, "mkstemp", deny_mkstemp)
+    assert run_cli(monkeypatch, str(proj), "-o", str(output)) == 0
+    assert "File: main.py" in output.read_text()
@@ -1,10 +1,16 @@
 import pytest
+import io
 import os
 import tempfile
 import fnmatch
 import shutil
+import threading
+import types
 from pathlib import Path
-from textmeld.textmeld import TextMeld
+from textmeld import textmeld as textmeld_module
+from textmeld.textmeld import (
+    NL_SEP10, SEP10, SKIPPED_TOO_LARGE, TextMeld, _FileTooLargeError, _read_text_file
+)
 
 @pytest.fixture
 def temp_directory():
@@ -182,3 +188,220 @@ def test_exclude_subdirectory():
     assert "def include_sub_func()" in result
     
 
+
+def test_exclude_cache_refreshes_after_gitignore(temp_directory):
+    """gitignore読み込み後に除外パターンのキャッシュが更新されることを確認"""
+    meld = TextMeld()
+    meld.base_dir = temp_directory
+    target = os.path.join(temp_directory, "debug.log")
+    assert not meld.should_exclude_from_content(target)
+
+    (Path(temp_directory) / ".gitignore").write_text("*.log\n")
+    meld.load_gitignore(temp_directory)
+    assert meld.should_exclude_from_content(target)
+
+def test_generate_tree_skips_excluded_before_drawing(temp_directory):
+    """除外されたエントリが末尾にあっても最後の要素に└──が付くことを確認"""
+    (Path(temp_directory) / "a.txt").write_text("a\n")
+    (Path(temp_directory) / "z.log").write_text("z\n")
+
+    meld = TextMeld(exclude_patterns=["*.log"])
+    tree = meld.generate_tree(temp_directory)
+    assert tree == "└── a.txt\n"
+
+def test_load_gitignore_only_once(sample_directory):
+    """同じ.gitignoreを複数回読み込んでもパターンが重複しないことを確認"""
+    meld = TextMeld()
+    meld.process_directory(sample_directory)
+    meld.load_gitignore(sample_directory)
+
+    assert meld.exclude_patterns.count("*.pyc") == 1
+    assert meld.exclude_patterns.count("__pycache__/") == 1
+
+def test_merge_files_skips_binary(temp_directory):
+    """NULバイトを含むファイルがバイナリとして除外されることを確認"""
+    (Path(temp_directory) / "text.txt").write_text("hello\n")
+    (Path(temp_directory) / "blob.bin").write_bytes(b"\x89PNG\x00\x00\x01")
+
+    meld = TextMeld()
+    merged = meld.merge_files(temp_directory)
+    assert "File: text.txt" in merged
+    assert "File: blob.bin" not in merged
+
+def test_name_patterns_match_nested_entries(temp_directory):
+    """"/"を含まないパターンがサブディレクトリ内の名前にも適用されることを確認"""
+    nested = Path(temp_directory) / "pkg" / "__pycache__"
+    nested.mkdir(parents=True)
+    (nested / "mod.cpython-311.pyc").write_text("cache\n")
+    (Path(temp_directory) / "pkg" / "mod.py").write_text("x = 1\n")
+
+    meld = TextMeld()
+    result = meld.process_directory(temp_directory)
+    assert "__pycache__" not in result
+    assert "File: pkg/mod.py" in result
+
+def test_process_directory_to_sink(sample_directory):
+    """sinkへの書き出しがprocess_directoryの戻り値と一致することを確認"""
+    buf = io.StringIO()
+    TextMeld().process_directory_to(sample_directory, buf)
+
+    assert buf.getvalue() == TextMeld().process_directory(sample_directory)
+
+def test_merge_files_skips_binary_extensions(temp_directory):
+    """既知のバイナリ拡張子のファイルが内容から除外され、ツリーには残ることを確認"""
+    (Path(temp_directory) / "logo.PNG").write_text("not really an image\n")
+
+    meld = TextMeld()
+    result = meld.process_directory(temp_directory)
+    assert "└── logo.PNG" in result
+    assert "File: logo.PNG" not in result
+
+@pytest.mark.parametrize("patterns,path,expected", [
+    (["/build"], "build", True),  # 先頭の"/"はベースディレクトリに固定
+    (["/build"], "src/build", False),
+    (["docs/**/*.md"], "docs/a/b/c.md", True),  # "**"は任意の階層
+    (["docs/*.md"], "docs/a/c.md", False),  # "*"は"/"をまたがない
+    (["*.log", "!keep.log"], "keep.log", False),  # "!"で再び含める
+    (["*.log", "!keep.log"], "other.log", True),
+    (["vendor/"], "vendor/lib/x.py", True),  # ディレクトリ配下も除外
+    (["[z-a]"], "z", False),  # 空の範囲は何にもマッチせず、エラーにならない
+    (["[z-a]", "*.log"], "a.log", True),
+    (["[[]x"], "[x", True),  # 文字クラス内の"["は文字として扱う
+    (["[[]x"], "x", False),
+    (["[&~|]"], "~", True),  # 集合演算の記号は文字として扱う
+    (["[&~|]"], "a", False),
+    (["[!a-c].txt"], "d.txt", True),
+    (["[!a-c].txt"], "b.txt", False),
+])
+def test_gitignore_semantics(patterns, path, expected):
+    """gitignore形式のパターンの解釈をテスト"""
+    meld = TextMeld(exclude_patterns=patterns)
+    assert meld.should_exclude_from_content(path) is expected
+
+def test_symlinks_are_ignored_by_default(temp_directory):
+    """シンボリックリンクがデフォルトで無視されることを確認"""
+    outside = tempfile.mkdtemp()
+    try:
+        (Path(outside) / "secret.txt").write_text("outside\n")
+        (Path(temp_directory) / "main.py").write_text("print('Hello')\n")
+        os.symlink(outside, os.path.join(temp_directory, "linked_dir"))
+        os.symlink(os.path.join(outside, "secret.txt"), os.path.join(temp_directory, "link.txt"))
+
+        result = TextMeld().process_directory(temp_directory)
+        assert "linked_dir" not in result
+        assert "link.txt" not in result
+        assert "outside" not in result
+
+        result = TextMeld(ignore_symlinks=False).process_directory(temp_directory)
+        assert "File: link.txt" in result
+        assert "linked_dir" in result
+        assert "File: linked_dir" not in result
+    finally:
+        shutil.rmtree(outside)
+
+def test_exclude_patterns_setter_resets_cache():
+    """exclude_patternsを置き換えると除外判定が更新されることを確認"""
+    meld = TextMeld(exclude_patterns=["*.log"])
+    assert meld.should_exclude_from_content("error.log")
+
+    meld.exclude_patterns = ["*.txt"]
+    assert not meld.should_exclude_from_content("error.log")
+    assert meld.should_exclude_from_content("notes.txt")
+
+def test_merge_files_respects_max_file_size(temp_directory):
+    """max_file_sizeを超えるファイルの内容が省略され、その旨が出力されることを確認"""
+    (Path(temp_directory) / "small.txt").write_text("small\n")
+    (Path(temp_directory) / "large.txt").write_text("x" * 100)
+
+    merged = TextMeld(max_file_size=50).merge_files(temp_directory)
+    assert "File: small.txt" in merged
+    assert "File: large.txt\n" + SEP10 + SKIPPED_TOO_LARGE in merged
+    assert "x" * 100 not in merged
+
+    # デフォルトでは上限なし
+    merged = TextMeld().merge_files(temp_directory)
+    assert "x" * 100 in merged
+
+
+def test_large_binary_is_skipped_silently(temp_directory):
+    """上限を超えるバイナリファイルは省略の見出しを出さずに除外されることを確認"""
+    (Path(temp_directory) / "big.bin").write_bytes(b"\x00" * 1000)
+    (Path(temp_directory) / "big.txt").write_text("x" * 1000)
+
+    merged = TextMeld(max_file_size=100).merge_files(temp_directory)
+    assert "File: big.bin" not in merged
+    assert "File: big.txt\n" + SEP10 + SKIPPED_TOO_LARGE in merged
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/status"), reason="requires procfs")
+def test_read_text_file_limits_unknown_size():
+    """サイズが0と報告されるファイルでも上限を超えた時点で打ち切ることを確認"""
+    assert os.stat("/proc/self/status").st_size == 0
+    with pytest.raises(_FileTooLargeError):
+        _read_text_file("/proc/self/status", max_size=10)
+    assert _read_text_file("/proc/self/status").startswith("Name:")
+
+def test_merge_limits_pending_reads(temp_directory, monkeypatch):
+    """書き出しを待つ読み込み結果が上限を超えて溜まらないことを確認"""
+    file_count = textmeld_module._MAX_PENDING_READS * 3
+    for i in range(file_count):
+        (Path(temp_directory) / f"f{i:03}.txt").write_text(f"{i}\n")
+
+    lock = threading.Lock()
+    counts = {"read": 0, "written": 0, "max_pending": 0}
+    original_read = textmeld_module._read_text_file
+
+    def counting_read(file_path, max_size=None):
+        with lock:
+            counts["read"] += 1
+            counts["max_pending"] = max(counts["max_pending"], counts["read"] - counts["written"])
+        return original_read(file_path, max_size)
+
+    class CountingStringIO(io.StringIO):
+        def write(self, s):
+            if s.startswith(NL_SEP10):
+                with lock:
+                    counts["written"] += 1
+            return super().write(s)
+
+    monkeypatch.setattr(textmeld_module, "_read_text_file", counting_read)
+    # merge_filesが内部で使う出力バッファだけを差し替える
+    monkeypatch.setattr(textmeld_module, "io", types.SimpleNamespace(StringIO=CountingStringIO))
+    merged = TextMeld().merge_files(temp_directory)
+
+    assert merged.count("File: ") == file_count
+    assert counts["written"] == file_count
+    assert counts["max_pending"] <= textmeld_module._MAX_PENDING_READS
+
+@pytest.mark.parametrize("patterns,rel_path,expected", [
+    (["*.log", "!src"], os.path.join("src", "a.log"), True),  # "!"は親ディレクトリの名前には適用しない
+    (["build", "!build/keep.txt"], os.path.join("build", "keep.txt"), True),  # 除外された親の配下は戻せない
+    (["*.log", "!keep.log"], os.path.join("src", "keep.log"), False),
+])
+def test_should_exclude_matches_walk(temp_directory, patterns, rel_path, expected):
+    """should_exclude_from_contentの判定が走査結果と一致することを確認"""
+    full_path = Path(temp_directory) / rel_path
+    full_path.parent.mkdir(parents=True, exist_ok=True)
+    full_path.write_text("content\n")
+
+    meld = TextMeld(exclude_patterns=list(patterns))
+    merged = meld.merge_files(temp_directory)
+
+    assert meld.should_exclude_from_content(str(full_path)) is expected
+    assert (f"File: {rel_path}" not in merged) is expected
+
+def test_path_patterns_independent_of_os_sep(temp_directory, monkeypatch):
+    """OSの区切り文字が"/"でなくても、"/"を含むパターンが下の階層に適用されることを確認"""
+    deep = Path(temp_directory) / "docs" / "a" / "b"
+    deep.mkdir(parents=True)
+    (deep / "c.md").write_text("excluded\n")
+    (deep / "c.txt").write_text("included\n")
+
+    # Windowsと同じ区切り文字を再現する（posixpathは"/"を使い続ける）
+    monkeypatch.setattr(os, "sep", "\\")
+    meld = TextMeld(exclude_patterns=["docs/**/*.md"])
+    merged = meld.merge_files(temp_directory)
+
+    assert "excluded" not in merged
+    assert "File: docs\\a\\b\\c.txt" in merged
+    assert meld.should_exclude_from_content(os.path.join(temp_directory, "docs\\a\\b\\c.md"))
@@ -1,5 +1,9 @@
 import argparse
+import os
+import re
+import stat
 import sys
+import tempfile
 from typing import List, Optional
 from textmeld.textmeld import TextMeld
 
@@ -23,28 +27,120 @@ def parse_args() -> argparse.Namespace:
         action="append",
         default=None
     )
+    parser.add_argument(
+        "--max-file-size",
+        help="Skip the content of files larger than this many bytes (default: no limit)",
+        type=int,
+        default=None
+    )
     return parser.parse_args()
 
+def _exclude_pattern_for(directory: str, path: str) -> Optional[str]:
+    """pathがdirectory内にある場合、それだけを除外するパターンを返す"""
+    directory = os.path.realpath(directory)
+    try:
+        if os.path.commonpath([directory, path]) != directory:
+            return None
+    except ValueError:
+        # Windowsで異なるドライブにある場合など
+        return None
+    rel_path = os.path.relpath(path, directory).replace(os.sep, "/")
+    # 先頭の"/"でベースディレクトリに固定し、ファイル名中のワイルドカードはエスケープする
+    return "/" + re.sub(r"([*?\[\\])", r"\\\1", rel_path)
+
+def _exclude_output_paths(meld: TextMeld, directory: str, *paths: str) -> None:
+    """出力先が処理対象に含まれないよう、除外パターンに追加する"""
+    patterns = []
+    for path in paths:
+        abs_path = os.path.abspath(path)
+        # リンク自体のパスと、リンク先の実体のパスの両方を除外する
+        link_path = os.path.join(
+            os.path.realpath(os.path.dirname(abs_path)), os.path.basename(abs_path)
+        )
+        for candidate in dict.fromkeys((link_path, os.path.realpath(abs_path))):
+            pattern = _exclude_pattern_for(directory, candidate)
+            if pattern is not None:
+                patterns.append(pattern)
+    meld.add_exclude_patterns(patterns)
+
+def _write_output(meld: TextMeld, directory: str, output: str) -> None:
+    """出力ファイルに書き出す
+
+    通常のファイル（または存在しないパス）の場合は一時ファイルに書き出し、
+    成功した場合のみ置き換える。シンボリックリンク、FIFO、デバイスなどはそのまま開いて書き込む。
+    """
+    try:
+        st: Optional[os.stat_result] = os.lstat(output)
+    except FileNotFoundError:
+        st = None
+
+    # ハードリンクされたファイルは置き換えるとリンクが切れるので直接書き込む
+    if st is None or (stat.S_ISREG(st.st_mode) and st.st_nlink == 1):
+        output_dir = os.path.dirname(os.path.abspath(output))
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                prefix="." + os.path.basename(output) + ".", suffix=".tmp", dir=output_dir
+            )
+        except OSError:
+            # 出力先のディレクトリに書き込めない場合は、ファイルに直接書き込む
+            if st is None:
+                raise
+        else:
+            _write_replacing(meld, directory, output, st, fd, tmp_path)
+            return
+
+    _exclude_output_paths(meld, directory, output)
+    with open(output, 'w', encoding='utf-8') as f:
+        meld.process_directory_to(directory, f)
+
+def _write_replacing(
+    meld: TextMeld,
+    directory: str,
+    output: str,
+    st: Optional[os.stat_result],
+    fd: int,
+    tmp_path: str,
+) -> None:
+    """一時ファイルに書き出し、成功した場合のみ出力ファイルを置き換える"""
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            # 出力ファイルと一時ファイルが処理対象に含まれないようにする
+            _exclude_output_paths(meld, directory, output, tmp_path)
+            meld.process_directory_to(directory, f)
+
+        if st is None:
+            # mkstempは0600で作成するので、通常のopenと同じ権限にそろえる
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o666 & ~umask)
+        else:
+            # 既存のファイルの権限を引き継ぐ
+            os.chmod(tmp_path, stat.S_IMODE(st.st_mode))
+        os.replace(tmp_path, output)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
 def main() -> int:
     """メイン関数"""
     try:
         args = parse_args()
         
         # TextMeldインスタンスの作成
-        meld = TextMeld(exclude_patterns=args.exclude)
-        
-        # ディレクトリの処理
-        result = meld.process_directory(args.directory)
+        meld = TextMeld(exclude_patterns=args.exclude, max_file_size=args.max_file_size)
         
-        # 結果の出力
+        # ディレクトリを処理し、結果を出力先に直接書き出す
         if args.output:
-            # ファイルに出力
-            with open(args.output, 'w', encoding='utf-8') as f:
-                f.write(result)
+            # ファイルに出力（失敗した場合は既存のファイルを残す）
+            _write_output(meld, args.directory, args.output)
             print(f"Result has been output to {args.output}.", file=sys.stderr)
         else:
             # 標準出力に出力
-            print(result)
+            meld.process_directory_to(args.directory, sys.stdout)
+            print()
         
         return 0
     
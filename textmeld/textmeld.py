@@ -1,40 +1,298 @@
+import functools
+import io
 import os
 from pathlib import Path
 import typing as typ
-import fnmatch
+import operator
 import re
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
-def _is_text_file(file_path: str) -> bool:
-    """ファイルがテキストファイルかどうかを判定"""
+# 出力の区切り線
+SEP10 = "=" * 10 + "\n"
+NL_SEP10 = "\n" + SEP10
+SEP20 = "=" * 20 + "\n"
+
+# 開かずにバイナリと判断できる拡張子
+BINARY_EXTS = frozenset({
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico', '.pdf',
+    '.zip', '.tar', '.gz', '.xz', '.bz2', '.7z',
+    '.so', '.dll', '.dylib', '.exe', '.o', '.a', '.class', '.jar',
+    '.pyc', '.pyo', '.wasm',
+    '.mp3', '.mp4', '.mov', '.avi',
+    '.ttf', '.otf', '.woff', '.woff2',
+})
+# 先頭のこのバイト数にNULが含まれていればバイナリとみなす
+_BINARY_PROBE_SIZE = 8192
+# ファイル読み込みはI/O待ちが主なので、CPU数より多めのスレッドを使う
+_MAX_READ_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# 同時に保持する読み込み結果の上限（書き出しが遅くてもメモリを使い切らないため）
+_MAX_PENDING_READS = 2 * _MAX_READ_WORKERS
+# サイズが不明なファイルを読む際の1回あたりの読み込みサイズ
+_READ_CHUNK_SIZE = 64 * 1024
+# サイズの上限を超えたファイルの内容の代わりに出力する文
+SKIPPED_TOO_LARGE = "(skipped (too large))\n"
+
+
+class _FileTooLargeError(Exception):
+    """ファイルがサイズの上限を超えている"""
+
+
+def _read_text_file(file_path: str, max_size: typ.Optional[int] = None) -> typ.Optional[str]:
+    """テキストファイルの内容を読み込む（読めない場合やバイナリの場合はNone）
+
+    max_sizeを超える場合は_FileTooLargeErrorを送出する。
+    """
+    # 1回のopenで読み込み、バイナリ判定もその内容で行う
     try:
-        with open(file_path, 'rb') as f:
-            raw = f.read(1024)
-        return True
-    except Exception:
-        return False
+        fd = os.open(file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    except OSError:
+        return None
+    try:
+        size = os.fstat(fd).st_size
+        if max_size is not None and size > max_size:
+            # バイナリは上限を超えていても通常どおり黙って除外する
+            if b"\x00" in os.read(fd, _BINARY_PROBE_SIZE):
+                return None
+            raise _FileTooLargeError(file_path)
+        # サイズ分を1回のreadで読み込む（サイズが0と報告されるファイルは分割して読む）
+        chunks: list[bytes] = []
+        total = 0
+        while not size or total < size:
+            if size:
+                want = size - total
+            elif max_size is not None:
+                # 上限を1バイト超えた時点で打ち切れるよう、読み込む量を制限する
+                want = min(_READ_CHUNK_SIZE, max_size + 1 - total)
+            else:
+                want = _READ_CHUNK_SIZE
+            chunk = os.read(fd, want)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            total += len(chunk)
+            # サイズが0と報告されたファイルも読み込んだ量で上限を確認する
+            if max_size is not None and total > max_size:
+                if b"\x00" in b"".join(chunks)[:_BINARY_PROBE_SIZE]:
+                    return None
+                raise _FileTooLargeError(file_path)
+        data = b"".join(chunks)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+    if b"\x00" in data[:_BINARY_PROBE_SIZE]:
+        return None
+    return data.decode('utf-8', errors='replace')
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """gitignore形式のglobパターンを正規表現に変換する
+
+    ``*`` と ``?`` は "/" をまたがず、``**`` は任意の階層にマッチする。
+    一致したディレクトリ配下のパスも併せてマッチする。
+    """
+    res: list[str] = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern.startswith("**", i):
+                j = i + 2
+                # 先頭または "/" の直後の "**/" は0個以上のディレクトリ
+                if (i == 0 or pattern[i - 1] == "/") and j < n and pattern[j] == "/":
+                    res.append("(?:.*/)?")
+                    i = j + 1
+                else:
+                    res.append(".*")
+                    i = j
+                continue
+            res.append("[^/]*")
+        elif c == "?":
+            res.append("[^/]")
+        elif c == "[":
+            j = i + 1
+            if j < n and pattern[j] in "!^":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+            if j >= n:
+                # 閉じていない "[" は文字として扱う
+                res.append(re.escape(c))
+            else:
+                res.append(_translate_char_class(pattern[i + 1:j]))
+                i = j + 1
+                continue
+        elif c == "\\" and i + 1 < n:
+            res.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        else:
+            res.append(re.escape(c))
+        i += 1
+    return "(?s:" + "".join(res) + r")(?:/.*)?\Z"
+
 
+def _translate_char_class(stuff: str) -> str:
+    """globの文字クラス（"[" と "]" の間）を正規表現に変換する（fnmatch.translateと同じ扱い）"""
+    negate = stuff[:1] in ("!", "^")
+    if negate:
+        stuff = stuff[1:]
+    if "-" not in stuff:
+        stuff = stuff.replace("\\", r"\\")
+    else:
+        # "-" で区切って範囲ごとに分ける
+        chunks: list[str] = []
+        i = 0
+        k = 1
+        while True:
+            k = stuff.find("-", k)
+            if k < 0:
+                break
+            chunks.append(stuff[i:k])
+            i = k + 1
+            k = k + 3
+        chunk = stuff[i:]
+        if chunk:
+            chunks.append(chunk)
+        else:
+            chunks[-1] += "-"
+        # 空の範囲（"z-a" など）は正規表現では不正なので取り除く
+        for k in range(len(chunks) - 1, 0, -1):
+            if chunks[k - 1][-1] > chunks[k][0]:
+                chunks[k - 1] = chunks[k - 1][:-1] + chunks[k][1:]
+                del chunks[k]
+        # 範囲を作らない "\\" と "-" はエスケープする
+        stuff = "-".join(s.replace("\\", r"\\").replace("-", r"\-") for s in chunks)
+    # 集合演算（&&, ~~, ||）や入れ子の集合と解釈されないようにエスケープする
+    stuff = re.sub(r"([&~|\[])", r"\\\1", stuff)
+    if not stuff:
+        # 空の文字クラスは何にもマッチしない（否定の場合は "/" 以外の任意の1文字）
+        return "[^/]" if negate else "(?!)"
+    if negate:
+        # "*" や "?" と同様に "/" はまたがない
+        return f"[^/{stuff}]"
+    if stuff[0] == "^":
+        stuff = "\\" + stuff
+    return f"[{stuff}]"
 
+
+def _compile_globs(patterns: list[str]) -> typ.Optional[re.Pattern[str]]:
+    """globパターンを1つの正規表現にまとめる（パターンが空の場合はNone）"""
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{_glob_to_regex(p)})" for p in patterns))
+
+
+class _GlobSet:
+    """除外パターン群を名前用と相対パス用の正規表現にまとめたもの"""
+
+    def __init__(self, patterns: list[str]):
+        literals: set[str] = set()
+        name_patterns: list[str] = []
+        path_patterns: list[str] = []
+        for pattern in patterns:
+            # / が最後にある場合は削除
+            pattern = pattern.rstrip("/")
+            if not pattern:
+                continue
+            if "/" in pattern:
+                # "/"を含むパターンはベースディレクトリからの相対パス全体と照合する
+                path_patterns.append(pattern[1:] if pattern.startswith("/") else pattern)
+            elif not any(c in pattern for c in "*?[\\"):
+                # ワイルドカードを含まない名前は集合で判定する
+                literals.add(pattern)
+            else:
+                name_patterns.append(pattern)
+        self.literals = frozenset(literals)
+        self.name_re = _compile_globs(name_patterns)
+        self.path_re = _compile_globs(path_patterns)
+
+    def match_names(self, rel_dir: str, names: list[str]) -> set[str]:
+        """ディレクトリ内の名前のうち、いずれかのパターンに一致するものを返す"""
+        # "/"を含まないパターンは名前だけで判定できるので、ループをCに任せる
+        matched = set(self.literals.intersection(names))
+        if self.name_re:
+            matched.update(filter(self.name_re.match, names))
+        if self.path_re:
+            for name in names:
+                if self.path_re.match(_join_rel(rel_dir, name)):
+                    matched.add(name)
+        return matched
+
+
+def _join_rel(rel_dir: str, name: str) -> str:
+    """相対ディレクトリと名前を"/"で連結する（ベースディレクトリ直下はrel_dirが空）
+
+    除外パターンは"/"区切りを前提とするため、走査中の相対パスはOSによらず"/"で区切る。
+    """
+    return rel_dir + "/" + name if rel_dir else name
+
+
+# パフォーマンス方針:
+# 処理の大半はディレクトリ走査とファイル読み込みのシステムコール待ちで、計算量は小さい。
+# Python側の演算を細かく最適化するより、open/statの回数を減らすことを優先する。
+# 変更を加える際は次の順で効果が大きいことを前提にする。
+#   1. 除外ディレクトリを降りる前に取り除く（_scan_dir内の除外判定）
+#   2. os.scandirのDirEntryが持つ種別情報を使い、追加のstatを避ける
+#   3. 除外判定は結合済みの正規表現と名前の集合で、ディレクトリ単位にまとめて行う
+#   4. 1回の走査でツリーと読み込み対象を集め、読み込みはスレッドで並列に行う
+#   5. 1ファイルにつき1回のopenと、サイズに合わせた1回のreadで読み込む
 class TextMeld:
     def __init__(
         self,
-        exclude_patterns: typ.Optional[list[str]] = None
+        exclude_patterns: typ.Optional[list[str]] = None,
+        ignore_symlinks: bool = True,
+        max_file_size: typ.Optional[int] = None
     ):
         default_ignore_patterns = [".git", "__pycache__", ".lock"]
+        # 除外パターンを結合した正規表現（除外用, "!"で再び含める用）
+        self._exclude_re: typ.Optional[tuple[_GlobSet, _GlobSet]] = None
+        self._exclude_sig: typ.Optional[int] = None
         self.exclude_patterns = exclude_patterns or []
-        self.exclude_patterns.extend(default_ignore_patterns)
+        self._add_exclude_patterns(default_ignore_patterns)
         self.base_dir = ""  # ベースディレクトリを保持
+        self.ignore_symlinks = ignore_symlinks  # シンボリックリンクを無視するか
+        self.max_file_size = max_file_size  # 内容を統合するファイルサイズの上限（Noneで無制限）
+        self._loaded_gitignores: set[str] = set()  # 読み込み済みの.gitignore
+
+    @property
+    def exclude_patterns(self) -> list[str]:
+        """除外パターンの一覧"""
+        return self._exclude_patterns_list
+
+    @exclude_patterns.setter
+    def exclude_patterns(self, value: list[str]) -> None:
+        self._exclude_patterns_list = value
+        self._exclude_re = None
+
+    def add_exclude_patterns(self, patterns: typ.Iterable[str]) -> None:
+        """除外パターンを追加する"""
+        self._add_exclude_patterns(patterns)
+
+    def _add_exclude_patterns(self, patterns: typ.Iterable[str]) -> None:
+        """除外パターンを追加し、結合済みの正規表現を破棄する"""
+        self._exclude_patterns_list.extend(patterns)
+        self._exclude_re = None
 
     def load_gitignore(self, directory: str) -> None:
         """.gitignoreファイルから除外パターンを読み込む"""
-        gitignore_path = os.path.join(directory, ".gitignore")
+        gitignore_path = os.path.realpath(os.path.join(directory, ".gitignore"))
+        # 同じ.gitignoreを二重に読み込まない
+        if gitignore_path in self._loaded_gitignores:
+            return
         if not os.path.exists(gitignore_path):
             return
+        self._loaded_gitignores.add(gitignore_path)
 
         with open(gitignore_path, 'r', encoding='utf-8') as f:
             ignore_pattern = f.read().splitlines()
             ignore_pattern = [p for p in ignore_pattern if p.strip() and not p.strip().startswith("#")]
-            self.exclude_patterns.extend(ignore_pattern)
+            known = set(self.exclude_patterns)
+            self._add_exclude_patterns(p for p in dict.fromkeys(ignore_pattern) if p not in known)
 
     def get_relative_path(self, file_path: str) -> str:
         """ベースディレクトリからの相対パスを取得"""
@@ -42,100 +300,156 @@ class TextMeld:
 
     def should_exclude_from_content(self, file_path: str) -> bool:
         """ファイルが除外パターンに一致するかチェック"""
-        rel_path = self.get_relative_path(file_path)
+        return self._should_exclude_rel(self.get_relative_path(file_path).replace(os.sep, "/"))
 
-        for pattern in self.exclude_patterns:
-            # / が最後にある場合は削除
-            if pattern.endswith("/"):
-                pattern = pattern[:-1]
-            # パターンを正規表現に変換
-            regex_pattern = fnmatch.translate(pattern)
-            if re.match(regex_pattern, rel_path):
+    def _should_exclude_rel(self, rel_path: str) -> bool:
+        """ベースディレクトリからの"/"区切りの相対パスが除外パターンに一致するかチェック"""
+        # 走査と同じく上の階層から順に判定し、途中のディレクトリが除外されていれば配下も除外する
+        rel_dir = ""
+        for name in rel_path.split("/"):
+            if self._excluded_names(rel_dir, [name]):
                 return True
+            rel_dir = _join_rel(rel_dir, name)
         return False
 
+    def _excluded_names(self, rel_dir: str, names: list[str]) -> set[str]:
+        """ディレクトリ内の名前をまとめて判定し、除外される名前の集合を返す"""
+        positive, negative = self._get_exclude_re()
+        excluded = positive.match_names(rel_dir, names)
+        if excluded:
+            excluded -= negative.match_names(rel_dir, list(excluded))
+        return excluded
+
+    def _get_exclude_re(self) -> tuple[_GlobSet, _GlobSet]:
+        """除外パターンと"!"付きのパターンをそれぞれ正規表現にまとめてキャッシュする"""
+        # 一覧が直接変更された場合に備えて長さも確認する
+        sig = len(self._exclude_patterns_list)
+        if self._exclude_re is None or self._exclude_sig != sig:
+            positive = [p for p in self._exclude_patterns_list if not p.startswith("!")]
+            negative = [p[1:] for p in self._exclude_patterns_list if p.startswith("!")]
+            self._exclude_re = (_GlobSet(positive), _GlobSet(negative))
+            self._exclude_sig = sig
+        return self._exclude_re
+
+    def _scan_dir(self, directory: str, rel_dir: str) -> list[os.DirEntry[str]]:
+        """ディレクトリ内のエントリを名前順に取得し、除外対象を取り除く"""
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=operator.attrgetter('name'))
+        if self.ignore_symlinks:
+            # DirEntryが保持する種別情報で判定でき、リンク先をstatしない
+            entries = [entry for entry in entries if not entry.is_symlink()]
+        excluded = self._excluded_names(rel_dir, [entry.name for entry in entries])
+        return [entry for entry in entries if entry.name not in excluded]
+
     def generate_tree(self, directory: str, prefix: str = "") -> str:
         """ディレクトリツリーを生成（全てのファイルを表示）"""
         self.base_dir = directory  # ベースディレクトリを設定
         self.load_gitignore(directory)
-        return self._generate_tree(directory, prefix)
-
-    def _generate_tree(self, directory: str, prefix: str = "") -> str:
-        tree = ""
-        items = sorted(os.listdir(directory))
+        buf = io.StringIO()
+        self._generate_tree(directory, buf, prefix)
+        return buf.getvalue()
 
-        for i, item in enumerate(items):
-            is_last = i == len(items) - 1
-            current_prefix = prefix + ("└── " if is_last else "├── ")
-            next_prefix = prefix + ("    " if is_last else "│   ")
+    def _generate_tree(self, directory: str, sink: typ.IO[str], prefix: str = "") -> None:
+        """ツリーの各行をsinkに書き出す"""
+        self._walk_once(directory, sink, None, prefix)
 
-            full_path = os.path.join(directory, item)
+    def _walk_once(
+        self,
+        directory: str,
+        tree_sink: typ.Optional[typ.IO[str]],
+        to_read: typ.Optional[list[tuple[str, str]]],
+        prefix: str = "",
+        rel_dir: str = "",
+    ) -> None:
+        """1回の走査でツリーをtree_sinkに書き出し、読み込むファイルを(パス, 相対パス)としてto_readに集める"""
+        # 除外対象は先に取り除き、除外ディレクトリには降りない
+        entries = self._scan_dir(directory, rel_dir)
 
-            # check if file should be excluded
-            if self.should_exclude_from_content(full_path):
-                continue
+        for i, entry in enumerate(entries):
+            is_last = i == len(entries) - 1
+            rel_path = _join_rel(rel_dir, entry.name)
 
-            # If item is directory, item is appended with '/'
-            if os.path.isdir(full_path):
-                item += "/"
+            # DirEntryが保持する種別情報を使い、追加のstatを避ける
+            is_dir = entry.is_dir(follow_symlinks=False)
 
-            tree += current_prefix + item + "\n"
+            if tree_sink is not None:
+                current_prefix = prefix + ("└── " if is_last else "├── ")
+                # If item is directory, item is appended with '/'
+                tree_sink.write(current_prefix + entry.name + ("/" if is_dir else "") + "\n")
 
-            if os.path.isdir(full_path):
-                tree += self._generate_tree(full_path, next_prefix)
+            if is_dir:
+                next_prefix = prefix + ("    " if is_last else "│   ")
+                self._walk_once(entry.path, tree_sink, to_read, next_prefix, rel_path)
+                continue
 
-        return tree
+            if to_read is None:
+                continue
+            # 通常ファイル以外（リンク先がディレクトリのものなど）は読まない
+            if not entry.is_file():
+                continue
+            # 既知のバイナリ拡張子はファイルを開く前に除外する
+            if os.path.splitext(entry.name)[1].lower() in BINARY_EXTS:
+                continue
+            # 見出しに出す相対パスはOSの区切り文字に戻す
+            to_read.append((entry.path, rel_path.replace("/", os.sep)))
 
     def merge_files(self, directory: str) -> str:
         """ファイルの内容を統合（除外パターンに一致するファイルは除く）"""
         self.base_dir = directory  # ベースディレクトリを設定
         self.load_gitignore(directory)
-        return self._merge_files(directory)
+        buf = io.StringIO()
+        self._merge_files(directory, buf)
+        return buf.getvalue()
 
-    def _merge_files(self, directory: str) -> str:
-        merged_content = ""
-
-        for item in os.listdir(directory):
-            full_path = os.path.join(directory, item)
-            
-            if os.path.isdir(full_path):
-                if not self.should_exclude_from_content(full_path):
-                    merged_content += self._merge_files(full_path)
-                continue
+    def _merge_files(self, directory: str, sink: typ.IO[str]) -> None:
+        """ファイルの内容をsinkに書き出す"""
+        to_read: list[tuple[str, str]] = []
+        self._walk_once(directory, None, to_read)
+        self._write_merged(to_read, sink)
 
-            if self.should_exclude_from_content(full_path):
-                continue
-
-            try:
-                if not _is_text_file(full_path):
-                    continue
-                    
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    merged_content += f"\n{'='*10}\n"
-                    merged_content += f"File: {self.get_relative_path(full_path)}\n"
-                    merged_content += f"{'='*10}\n"
-                    merged_content += content + "\n"
-            except Exception as e:
-                continue
+    def _write_merged(self, to_read: list[tuple[str, str]], sink: typ.IO[str]) -> None:
+        """集めたファイルを読み込み、内容をsinkに書き出す"""
+        # 読み込みは並列に行い、結果は走査順に書き出す
+        # 先行して読み込むのは_MAX_PENDING_READS件までとし、1件書き出すごとに次を投入する
+        read = functools.partial(_read_text_file, max_size=self.max_file_size)
+        with ThreadPoolExecutor(max_workers=_MAX_READ_WORKERS) as executor:
+            pending: deque[tuple[str, Future[typ.Optional[str]]]] = deque()
+            for path, rel_path in to_read:
+                pending.append((rel_path, executor.submit(read, path)))
+                if len(pending) >= _MAX_PENDING_READS:
+                    self._write_file_block(sink, *pending.popleft())
+            while pending:
+                self._write_file_block(sink, *pending.popleft())
 
-        return merged_content
+    def _write_file_block(
+        self, sink: typ.IO[str], rel_path: str, future: Future[typ.Optional[str]]
+    ) -> None:
+        """読み込みの完了を待ち、1ファイル分の内容をsinkに書き出す"""
+        try:
+            content = future.result()
+        except _FileTooLargeError:
+            # 上限を超えたファイルは省略したことが分かるように出力する
+            content = SKIPPED_TOO_LARGE
+        if content is None:
+            return
+        sink.write("".join((NL_SEP10, "File: ", rel_path, "\n", SEP10, content, "\n")))
 
     def process_directory(self, directory: str) -> str:
         """ディレクトリを処理し、ツリーとマージされた内容を出力"""
-        self.base_dir = directory  # ベースディレクトリを設定
-        
-        # ツリー構造を生成
-        tree = self.generate_tree(directory)
+        buf = io.StringIO()
+        self.process_directory_to(directory, buf)
+        return buf.getvalue()
 
-        # ファイル内容を統合
-        merged_content = self.merge_files(directory)
+    def process_directory_to(self, directory: str, sink: typ.IO[str]) -> None:
+        """ディレクトリを処理し、ツリーとマージされた内容をsinkに直接書き出す"""
+        self.base_dir = directory  # ベースディレクトリを設定
+        self.load_gitignore(directory)
 
-        output_str = "Directory Structure:\n"
-        output_str += "="*20 + "\n"
-        output_str += tree
-        output_str += "\nMerged Content:\n"
-        output_str += "="*20 + "\n"
-        output_str += merged_content
+        # ツリー構造を生成し、同じ走査で読み込むファイルも集める
+        sink.write("Directory Structure:\n" + SEP20)
+        to_read: list[tuple[str, str]] = []
+        self._walk_once(directory, sink, to_read)
 
-        return output_str
\ No newline at end of file
+        # ファイル内容を統合
+        sink.write("\nMerged Content:\n" + SEP20)
+        self._write_merged(to_read, sink)